@@ -1,55 +1,78 @@
 # main.py
-import io
-import json
-from typing import Optional
-
+import asyncio
+import bisect
+import hashlib
+import importlib.util
+import itertools
+import math
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+import numpy as np
 import torch
+import torchaudio
 import soundfile as sf
-from fastapi import FastAPI, File, Form, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from transformers import (
+    AutoConfig,
     AutoProcessor,
     AutoModelForCTC,
     AutoTokenizer,
     AutoModelForSeq2SeqLM,
 )
 
+try:
+    import ctranslate2  # optional: faster T5 decoding
+except ImportError:
+    ctranslate2 = None
+
 # ============================================================
 # 0. IPA utilities (normalization + helpers)
 # ============================================================
 
 # basic sets – extend as needed
-VOWELS = {
+VOWELS = frozenset({
     "a", "e", "i", "o", "u",
     "æ", "ʌ", "ɪ", "ʊ", "ə", "ɛ", "ɔ", "ɑ", "ɜ", "ɒ"
+})
+NASALS = frozenset({"n", "m", "ŋ"})
+
+
+# stress / prosody marks, dropped outright
+STRESS_MARKS = str.maketrans("", "", "ˈˌ")
+
+# common diacritics collapsed into base symbols (you can extend this map
+# as needed); nasalization is offloaded by dropping the combining tilde
+DIACRITIC_MAP = {
+    "tʰ": "t",
+    "t̠": "t",
+    "d̠": "d",
+    "ɹ̩": "ɹ",
+    "l̩": "l",
+    "\u0303": "",
 }
-NASALS = {"n", "m", "ŋ"}
+DIACRITIC_RE = re.compile("|".join(map(re.escape, DIACRITIC_MAP)))
 
 
+@lru_cache(maxsize=512)
 def normalize_ipa(ipa_seq: str) -> str:
     """
     Normalize espeak-style / noisy IPA from wav2vec2 into a
     smaller, more canonical inventory that matches what T5 saw
     during fine-tuning.
     """
-    toks = ipa_seq.split()
-    norm = []
-
-    for p in toks:
-        # strip common stress / prosody marks
-        p = p.replace("ˈ", "").replace("ˌ", "")
-
-        # collapse common diacritics into base symbols
-        p = p.replace("tʰ", "t").replace("t̠", "t")
-        p = p.replace("d̠", "d")
-        p = p.replace("ɹ̩", "ɹ").replace("l̩", "l")
-        p = p.replace("̃", "")  # nasalization offload
-
-        # you can extend this map as needed
-        norm.append(p)
-
-    return " ".join(norm)
+    ipa_seq = ipa_seq.translate(STRESS_MARKS)
+    ipa_seq = DIACRITIC_RE.sub(lambda m: DIACRITIC_MAP[m.group()], ipa_seq)
+    return " ".join(ipa_seq.split())
 
 
 def collapse_repeats(tokens):
@@ -71,7 +94,17 @@ def collapse_repeats(tokens):
 # -------------------------------------------------------------------
 # 1. FastAPI setup + CORS
 # -------------------------------------------------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs inside each Uvicorn worker process, so every worker loads its
+    # own models (and CUDA context) exactly once.
+    load_models()
+    await start_batch_workers(app)
+    yield
+    await stop_batch_workers(app)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -82,23 +115,166 @@ app.add_middleware(
 )
 
 # -------------------------------------------------------------------
-# 2. Load models once at startup
+# 2. Load models once per worker (called from the lifespan above)
 # -------------------------------------------------------------------
 WAV2VEC2_ID = "facebook/wav2vec2-lv-60-espeak-cv-ft"
 IPA2TEXT_ID = "zanegraper/t5-ipa-to-text"  # your model
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-print("Loading wav2vec2 model...")
-w2v_processor = AutoProcessor.from_pretrained(WAV2VEC2_ID)
-w2v_model = AutoModelForCTC.from_pretrained(WAV2VEC2_ID).to(device)
+# Opt-in int8 weights for the wav2vec2 Linear layers (CPU only). Check
+# phoneme accuracy on held-out audio before turning this on.
+W2V_INT8 = os.environ.get("W2V_INT8", "0") == "1"
+
+# Compile the wav2vec2 forward with "reduce-overhead" (CUDA graphs).
+# Batches up to 30 s are padded to a fixed set of (batch size, bucket)
+# shapes; each is run twice at startup, since a graph is only recorded
+# on a shape's second call. Longer clips run eager.
+W2V_COMPILE = os.environ.get(
+    "W2V_COMPILE", "1" if device.type == "cuda" else "0"
+) == "1"
+
+# converted fast (Rust) tokenizer is cached here after the first run
+T5_FAST_TOKENIZER_DIR = os.environ.get("T5_FAST_TOKENIZER_DIR", "t5_tokenizer_fast")
+TOKENIZER_PARITY_SAMPLE = "ð ə | k æ t | s æ t | ɑ n | ð ə | m æ t"
+
+# CTranslate2 export of the T5 model; used instead of the PyTorch model
+# when present (see README for the conversion command)
+T5_CT2_DIR = os.environ.get("T5_CT2_DIR", "t5_ct2")
+
+# Set by load_models()
+w2v_dtype = t5_dtype = torch.float32
+w2v_processor = None
+w2v_feature_extractor = None
+w2v_model = None
+w2v_compiled_forward = None
+w2v_copy_stream = None
+t5_tokenizer = None
+t5_model = None
+t5_translator = None
+
+
+def load_t5_tokenizer():
+    """
+    Load the fast tokenizer for the T5 model. The first time, the slow
+    SentencePiece tokenizer is converted, checked for identical ids on a
+    fixture IPA string, and saved so later starts skip the conversion.
+    """
+    if os.path.isfile(os.path.join(T5_FAST_TOKENIZER_DIR, "tokenizer.json")):
+        return AutoTokenizer.from_pretrained(T5_FAST_TOKENIZER_DIR, use_fast=True)
+
+    slow = AutoTokenizer.from_pretrained(IPA2TEXT_ID, use_fast=False)
+    fast = AutoTokenizer.from_pretrained(IPA2TEXT_ID, use_fast=True)
+
+    if not fast.is_fast or (
+        fast(TOKENIZER_PARITY_SAMPLE)["input_ids"]
+        != slow(TOKENIZER_PARITY_SAMPLE)["input_ids"]
+    ):
+        print("Fast T5 tokenizer does not match the slow one, using slow tokenizer")
+        return slow
+
+    # Save into a scratch dir next to the target and rename it into place,
+    # so other workers starting at the same time never see a half-written
+    # directory. If one of them got there first, keep theirs.
+    target = os.path.abspath(T5_FAST_TOKENIZER_DIR)
+    scratch = tempfile.mkdtemp(prefix=".tokenizer-", dir=os.path.dirname(target))
+    fast.save_pretrained(scratch)
+    try:
+        os.replace(scratch, target)
+    except OSError:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return fast
+
+
+def load_models() -> None:
+    """
+    Load wav2vec2 and the IPA→text model into this process.
+    """
+    global w2v_dtype, t5_dtype
+    global w2v_processor, w2v_feature_extractor, w2v_model, w2v_copy_stream
+    global w2v_compiled_forward
+    global t5_tokenizer, t5_model, t5_translator
+
+    # Half-precision weights on GPU: bf16 on Ampere+ (native bf16), else
+    # fp16 (V100/T4). Gated on compute capability rather than
+    # is_bf16_supported(), which also reports emulated bf16 on older
+    # cards. T5 overflows in fp16, so it only drops to bf16 and otherwise
+    # stays fp32.
+    ampere_or_newer = (
+        device.type == "cuda" and torch.cuda.get_device_capability(device) >= (8, 0)
+    )
+    if device.type == "cuda":
+        w2v_dtype = torch.bfloat16 if ampere_or_newer else torch.float16
+        t5_dtype = torch.bfloat16 if ampere_or_newer else torch.float32
+
+    # Fused attention kernels: FlashAttention-2 needs the flash-attn
+    # package, an Ampere+ GPU (its kernels refuse older cards) and
+    # half-precision weights; PyTorch SDPA otherwise.
+    if (
+        ampere_or_newer
+        and w2v_dtype != torch.float32
+        and importlib.util.find_spec("flash_attn") is not None
+    ):
+        w2v_attn = "flash_attention_2"
+    else:
+        w2v_attn = "sdpa"
+
+    print(f"Loading wav2vec2 model ({w2v_attn} attention)...")
+    w2v_processor = AutoProcessor.from_pretrained(WAV2VEC2_ID)
+    w2v_feature_extractor = w2v_processor.feature_extractor
+    w2v_model = (
+        AutoModelForCTC.from_pretrained(
+            WAV2VEC2_ID,
+            torch_dtype=w2v_dtype,
+            attn_implementation=w2v_attn,
+        )
+        .to(device)
+        .eval()
+    )
 
-print("Loading IPA→text T5 model...")
-t5_tokenizer = AutoTokenizer.from_pretrained(
-    IPA2TEXT_ID,
-    use_fast=False,
-)
-t5_model = AutoModelForSeq2SeqLM.from_pretrained(IPA2TEXT_ID).to(device)
+    if W2V_INT8 and device.type == "cpu":
+        print("Quantizing wav2vec2 Linear layers to int8...")
+        w2v_model = torch.ao.quantization.quantize_dynamic(
+            w2v_model,
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+        )
+
+    if W2V_COMPILE:
+        w2v_compiled_forward = torch.compile(
+            w2v_model.forward, mode="reduce-overhead"
+        )
+
+    if device.type == "cuda":
+        # side stream for copying CTC ids back to the host
+        w2v_copy_stream = torch.cuda.Stream()
+
+    print("Loading IPA→text T5 model...")
+    t5_tokenizer = load_t5_tokenizer()
+
+    if ctranslate2 is not None and os.path.isdir(T5_CT2_DIR):
+        print(f"Using CTranslate2 T5 from {T5_CT2_DIR}")
+        t5_translator = ctranslate2.Translator(T5_CT2_DIR, device=device.type)
+        return
+
+    # SDPA only where this transformers release implements it for the
+    # model class (T5's relative position bias has no SDPA path in the
+    # pinned 4.44); asked for explicitly, from_pretrained would raise
+    t5_class = AutoModelForSeq2SeqLM._model_mapping[
+        type(AutoConfig.from_pretrained(IPA2TEXT_ID))
+    ]
+    t5_attn = "sdpa" if getattr(t5_class, "_supports_sdpa", False) else "eager"
+
+    print(f"Loading T5 weights ({t5_attn} attention)...")
+    t5_model = (
+        AutoModelForSeq2SeqLM.from_pretrained(
+            IPA2TEXT_ID,
+            torch_dtype=t5_dtype,
+            attn_implementation=t5_attn,
+        )
+        .to(device)
+        .eval()
+    )
 
 
 # -------------------------------------------------------------------
@@ -131,137 +307,580 @@ class PipelineResponse(BaseModel):
 
 
 # -------------------------------------------------------------------
-# 4. Helper: run wav2vec2 on audio -> phoneme string (mostly unchanged)
+# 4. Helper: run wav2vec2 on audio -> phoneme string (batched)
 # -------------------------------------------------------------------
-def transcribe_to_ipa(audio_bytes: bytes) -> str:
-    # Read audio as mono 16k float32
-    audio_io = io.BytesIO(audio_bytes)
-    audio, sr = sf.read(audio_io)
+def to_device(t: torch.Tensor) -> torch.Tensor:
+    """
+    Host tensor -> model device. On CUDA the copy goes through pinned
+    memory and is non-blocking, so it can overlap with queued kernels.
+    """
+    if device.type == "cuda":
+        return t.pin_memory().to(device, non_blocking=True)
+    return t
+
+
+def read_audio(audio_file: BinaryIO):
+    """
+    Decode an upload to a mono float32 array plus its sample rate
+    (resampling to 16k happens on device, in prepare_w2v_inputs).
+    libsndfile reads straight from the file object, no bytes copy.
+    """
+    audio_file.seek(0)
+    # float32 straight from libsndfile (no float64 intermediate)
+    audio, sr = sf.read(audio_file, dtype="float32", always_2d=False)
 
     if audio.ndim > 1:
         # convert to mono
         audio = audio.mean(axis=1)
 
-    # NOTE: ideally resample to 16k here if sr != 16000
+    return audio, sr
+
+
+# Polyphase resampling to 16k. The sinc kernel grows with the reduced
+# rate ratio max(sr, 16000) / gcd(sr, 16000), so an arbitrary rate like
+# 44101 Hz would need a ~3 GB filter. Rates up to this ratio are
+# accepted: 640 is what 11.025 kHz needs (~1 MB filter), 22.05 / 44.1 kHz
+# need 441, and multiples of 8 kHz need single digits.
+MAX_RESAMPLE_RATIO = 640
+
+# one Resample module per input rate, built on first use (only ever
+# touched from the wav2vec2 worker thread)
+resamplers = {}
+
+
+def resample_supported(sr: int) -> bool:
+    return sr > 0 and max(sr, 16000) // math.gcd(sr, 16000) <= MAX_RESAMPLE_RATIO
+
+
+def get_resampler(sr: int) -> torchaudio.transforms.Resample:
+    if sr not in resamplers:
+        if not resample_supported(sr):
+            raise ValueError(f"Unsupported sample rate {sr} Hz")
+        resamplers[sr] = torchaudio.transforms.Resample(sr, 16000).to(device)
+    return resamplers[sr]
+
+
+def resampled_length(n_samples: int, sr: int) -> int:
+    # same rounding as torchaudio's resample
+    return -(-n_samples * 16000 // sr)
+
+
+def w2v_compiled_shape(n_samples: int, n_clips: int):
+    """
+    (batch, samples) shape a batch is padded to for the compiled model:
+    the next compiled batch size and the top of its length bucket. Clips
+    longer than the last bucket return None and run uncompiled, so the
+    set of compiled shapes stays finite (and all of it is warmed up).
+    """
+    i = bisect.bisect_left(W2V_BUCKET_SAMPLES, n_samples)
+    if i == len(W2V_BUCKET_SAMPLES):
+        return None
+
+    batch = next(b for b in W2V_COMPILED_BATCH_SIZES if b >= n_clips)
+    return batch, W2V_BUCKET_SAMPLES[i]
 
-    inputs = w2v_processor(
-        audio,
-        sampling_rate=sr,
-        return_tensors="pt",
-        padding=True,
+
+def prepare_w2v_inputs(clips, shape=None):
+    """
+    Torch version of the wav2vec2 feature extractor, run on device:
+    resampling to 16k, per-clip zero-mean / unit-variance normalization,
+    padding to the longest clip (or to a fixed (batch, samples) shape),
+    and an attention mask from the lengths. Returns the model inputs and
+    the 16k lengths of the real clips.
+    """
+    fe = w2v_feature_extractor
+    waves = []
+    for audio, sr in clips:
+        x = to_device(torch.from_numpy(audio))
+        if sr != 16000:
+            x = get_resampler(sr)(x)
+        if fe.do_normalize:
+            x = (x - x.mean()) / torch.sqrt(x.var(correction=0) + 1e-7)
+        waves.append(x)
+
+    lengths = [len(x) for x in waves]
+    rows, width = shape if shape is not None else (len(waves), max(lengths))
+
+    input_values = torch.full(
+        (rows, width), fe.padding_value, dtype=torch.float32, device=device
+    )
+    for row, x in zip(input_values, waves):
+        row[: len(x)] = x
+
+    inputs = {"input_values": input_values.to(w2v_dtype)}
+    if fe.return_attention_mask:
+        # dummy rows that only fill out the batch are silence with a full
+        # mask: a fully masked row can turn into NaNs in some attention
+        # kernels, and their outputs are dropped anyway
+        mask_lengths = lengths + [width] * (rows - len(waves))
+        positions = torch.arange(width, device=device)
+        inputs["attention_mask"] = (
+            positions[None, :] < torch.tensor(mask_lengths, device=device)[:, None]
+        ).long()
+    return inputs, lengths
+
+
+def launch_w2v_batch(clips):
+    """
+    Queue one wav2vec2 forward over a padded batch of (audio, sr) mono
+    clips. The CTC ids are copied back to pinned host memory on a side
+    stream, so this returns without waiting for the GPU; pass the
+    result to finish_w2v_batch to get the phoneme strings.
+    """
+    shape = None
+    if W2V_COMPILE:
+        # fixed (batch, bucket) shapes, so compiled graphs get reused
+        shape = w2v_compiled_shape(
+            max(resampled_length(len(a), sr) for a, sr in clips), len(clips)
+        )
+    forward = w2v_compiled_forward if shape is not None else w2v_model
+
+    inputs, lengths = prepare_w2v_inputs(clips, shape)
+
+    with torch.inference_mode():
+        logits = forward(**inputs).logits[: len(clips)]
+        pred_ids = torch.argmax(logits, dim=-1)
+
+        copied = None
+        if w2v_copy_stream is not None:
+            host_ids = torch.empty(pred_ids.shape, dtype=pred_ids.dtype, pin_memory=True)
+            w2v_copy_stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(w2v_copy_stream):
+                host_ids.copy_(pred_ids, non_blocking=True)
+                pred_ids.record_stream(w2v_copy_stream)
+                copied = torch.cuda.Event()
+                copied.record()
+            pred_ids = host_ids
+
+    # drop the frames that only cover padding, so a short clip decodes
+    # the same inside a batch as it would on its own
+    frame_lengths = w2v_model._get_feat_extract_output_lengths(
+        torch.tensor(lengths)
     )
+    return pred_ids, copied, frame_lengths.tolist()
 
-    with torch.no_grad():
-        logits = w2v_model(**{k: v.to(device) for k, v in inputs.items()}).logits
 
-    pred_ids = torch.argmax(logits, dim=-1)
-    text = w2v_processor.batch_decode(pred_ids)[0]
+def finish_w2v_batch(launched) -> list:
+    """
+    Wait for the ids from launch_w2v_batch and CTC-decode them into
+    one phoneme string per clip.
+    """
+    pred_ids, copied, frame_lengths = launched
+    if copied is not None:
+        copied.synchronize()
+
+    texts = w2v_processor.batch_decode(
+        [ids[:n] for ids, n in zip(pred_ids, frame_lengths)]
+    )
 
     # espeak-style phonemes; we'll normalize downstream
-    return text.strip()
+    return [t.strip() for t in texts]
+
+
+def run_w2v_batch(clips) -> list:
+    return finish_w2v_batch(launch_w2v_batch(clips))
+
+
+def warm_up_w2v() -> None:
+    """
+    Run silent clips through every (batch size, length bucket) shape the
+    compiled model can see, so compilation and CUDA-graph recording
+    happen at startup rather than while requests are queued. Each shape
+    runs twice: the first call compiles it and runs without a graph,
+    the second records the graph that later calls replay.
+    """
+    for n_samples in W2V_BUCKET_SAMPLES:
+        silence = (np.zeros(n_samples, dtype=np.float32), 16000)
+        for batch in W2V_COMPILED_BATCH_SIZES:
+            for _ in range(2):
+                run_w2v_batch([silence] * batch)
+
+
+async def transcribe_to_ipa(audio, sr: int) -> str:
+    return await w2v_batcher.submit((audio, sr), resampled_length(len(audio), sr))
+
+
+# Raw IPA per uploaded clip, so re-running the same recording with
+# different rule toggles skips wav2vec2 entirely.
+ASR_CACHE_SIZE = 512
+asr_cache: "OrderedDict[bytes, str]" = OrderedDict()
+
+
+def hash_audio(audio_file: BinaryIO) -> bytes:
+    # streamed in chunks, so the upload is never held as one bytes object
+    digest = hashlib.blake2b(digest_size=16)
+    audio_file.seek(0)
+    for chunk in iter(lambda: audio_file.read(1 << 16), b""):
+        digest.update(chunk)
+    return digest.digest()
+
+
+async def transcribe_upload(audio_file: BinaryIO) -> str:
+    # hashing and decoding run in a thread so they don't block the
+    # event loop
+    key = await asyncio.to_thread(hash_audio, audio_file)
+    if key in asr_cache:
+        asr_cache.move_to_end(key)
+        return asr_cache[key]
+
+    audio, sr = await asyncio.to_thread(read_audio, audio_file)
+    # reject here, before batching, so one bad clip can't fail the
+    # other requests in its batch
+    if not resample_supported(sr):
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Unsupported sample rate {sr} Hz; use 16 kHz or a common "
+                "rate such as 22.05, 44.1 or 48 kHz"
+            ),
+        )
+    raw_ipa = await transcribe_to_ipa(audio, sr)
+
+    asr_cache[key] = raw_ipa
+    if len(asr_cache) > ASR_CACHE_SIZE:
+        asr_cache.popitem(last=False)
+    return raw_ipa
 
 
 # -------------------------------------------------------------------
 # 5. Helper: apply phonological rules on IPA string (optimized)
 # -------------------------------------------------------------------
+def rule_flags(rules: RuleConfig) -> tuple:
+    """
+    Flatten a RuleConfig into a hashable tuple of its toggles.
+    """
+    return (
+        rules.gliding.w_to_r,
+        rules.gliding.l_to_w,
+        rules.gliding.r_to_w,
+        rules.stopping.s_to_t,
+        rules.stopping.z_to_d,
+        rules.cluster_reduction,
+    )
+
+
 def apply_rules(raw_ipa: str, rules: RuleConfig) -> str:
     """
     Apply phonological corrections in a token-aware way.
     Assumes raw_ipa already contains '|' boundaries where present.
     """
+    return apply_rule_flags(raw_ipa, rule_flags(rules))
+
+
+def compile_rule_plan(flags: tuple) -> tuple:
+    """
+    Resolve one rule_flags() combination into what the token loop
+    needs: (w gliding target or None, stopping map, cluster flag).
+    """
+    w_to_r, l_to_w, r_to_w, s_to_t, z_to_d, cluster_reduction = flags
+
+    # Child says "wabbit" for "rabbit": /l/ → /w/ corrects w -> l,
+    # /r/ → /w/ corrects w -> ɹ (l wins if both are enabled).
+    if l_to_w:
+        w_target = "l"
+    elif w_to_r or r_to_w:
+        w_target = "ɹ"
+    else:
+        w_target = None
+
+    # -------------------------
+    # STOPPING (correction: child's stop -> adult fricative)
+    # /s/ → /t/: child says "tun" for "sun" → t -> s
+    # /z/ → /d/: child says "doo" for "zoo" → d -> z
+    # -------------------------
+    stopping = {}
+    if s_to_t:
+        stopping["t"] = "s"
+    if z_to_d:
+        stopping["d"] = "z"
+
+    return w_target, stopping, cluster_reduction
+
+
+# Every combination of the 6 toggles (64 plans), built once at import
+RULE_PLANS = {
+    flags: compile_rule_plan(flags)
+    for flags in itertools.product((False, True), repeat=6)
+}
+
+
+@lru_cache(maxsize=1024)
+def apply_rule_flags(raw_ipa: str, flags: tuple) -> str:
+    """
+    apply_rules on a rule_flags() tuple, memoized per (ipa, flags).
+    Single pass over the tokens: substitutions, cluster repair and
+    repeat collapsing all happen as each token is emitted.
+    """
+    w_target, stopping, cluster_reduction = RULE_PLANS[flags]
     toks = raw_ipa.split()
     out = []
 
+    # -------------------------
+    # CLUSTER REDUCTION
+    # Example: child reduces /sp/ to [p]. Since this is *correction*,
+    # we re-insert the 's' before 'p' when enabled (" p" -> " s p"),
+    # unless the previous token is already 's' or a boundary.
+    # -------------------------
+    n_toks = len(toks)
+
     for i, p in enumerate(toks):
         # Keep boundaries untouched
         if p == "|":
             out.append(p)
             continue
 
-        # Lookahead vowel for some gliding contexts
-        next_sym = toks[i + 1] if i + 1 < len(toks) else None
-        next_is_vowel = next_sym in VOWELS if next_sym is not None else False
-
         # -------------------------
         # GLIDING (correction: child's /w/ -> adult target)
+        # only before a vowel (lookahead)
         # -------------------------
+        if p == "w" and w_target is not None:
+            if i + 1 < n_toks and toks[i + 1] in VOWELS:
+                p = w_target
 
-        # Child says "wabbit" for "rabbit":
-        # underlying /ɹ/ is realized as [w]; we map w -> ɹ
-        if p == "w":
-            # /l/ → /w/ pattern: child uses w for l → correct w -> l
-            if rules.gliding.l_to_w and next_is_vowel:
-                p = "l"
-            # /r/ → /w/ pattern: child uses w for r → correct w -> ɹ
-            elif (rules.gliding.w_to_r or rules.gliding.r_to_w) and next_is_vowel:
-                p = "ɹ"
-
-        # -------------------------
-        # STOPPING (correction: child's stop -> adult fricative)
-        # -------------------------
-        # /s/ → /t/: child says "tun" for "sun" → t -> s
-        if rules.stopping.s_to_t and p == "t":
-            p = "s"
+        p = stopping.get(p, p)
 
-        # /z/ → /d/: child says "doo" for "zoo" → d -> z
-        if rules.stopping.z_to_d and p == "d":
-            p = "z"
+        if cluster_reduction and p == "p" and out and out[-1] not in ("s", "|"):
+            out.append("s")
 
+        # Collapse any accidental repeats (except '|')
+        if out and out[-1] == p:
+            continue
         out.append(p)
 
-    # -------------------------
-    # CLUSTER REDUCTION
-    # Example: child reduces /sp/ to [p]; we re-insert 's' by
-    # default right now we only *remove* 's' if user wants
-    # to simulate cluster reduction. Here we're correcting:
-    # we want to REMOVE extra 's' if modeling the child,
-    # but since this is *correction*, we usually shouldn't
-    # add new 's'. To follow your original code's intent,
-    # we *insert* an 's' before 'p' when enabled.
-    # -------------------------
-
-    if rules.cluster_reduction:
-        # Based on your original: " p" -> " s p" (add /s/ before /p/)
-        corrected = []
-        for i, p in enumerate(out):
-            # don't try to manipulate boundaries
-            if p == "|" or not corrected:
-                corrected.append(p)
-                continue
-
-            # if we see a 'p' and previous is not 's' or '|', insert 's' before it
-            if p == "p" and corrected[-1] not in ("s", "|"):
-                corrected.append("s")
-                corrected.append("p")
-            else:
-                corrected.append(p)
-        out = corrected
-
-    # Collapse any accidental repeats (except '|')
-    out = collapse_repeats(out)
-
     return " ".join(out)
 
 
 # -------------------------------------------------------------------
-# 6. Helper: IPA -> text via T5 (unchanged)
+# 6. Helper: IPA -> text via T5 (batched)
 # -------------------------------------------------------------------
-def decode_ipa_to_text(ipa: str) -> str:
-    inputs = t5_tokenizer(
-        ipa,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-    )
-    with torch.no_grad():
+def run_t5_batch(batch_ids) -> list:
+    """
+    Run one beam-search generate over a batch of tokenized IPA strings
+    (lists of input ids, see decode_ipa_to_text) and return one decoded
+    sentence per input.
+    """
+    if t5_translator is not None:
+        return run_t5_batch_ct2(batch_ids)
+
+    if len(batch_ids) == 1:
+        # a lone sequence needs no padding and no attention mask
+        inputs = {"input_ids": torch.tensor(batch_ids)}
+    else:
+        inputs = t5_tokenizer.pad(
+            {"input_ids": batch_ids},
+            padding=True,
+            return_tensors="pt",
+        )
+
+    inputs = {k: to_device(v) for k, v in inputs.items()}
+    with torch.inference_mode():
         outputs = t5_model.generate(
-            **{k: v.to(device) for k, v in inputs.items()},
+            **inputs,
             max_length=64,
             num_beams=4,
             early_stopping=True,
         )
-    text = t5_tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return text.strip()
+    texts = t5_tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    return [t.strip() for t in texts]
+
+
+def run_t5_batch_ct2(batch_ids) -> list:
+    """
+    Same as run_t5_batch, but decoding with the CTranslate2 translator,
+    which works on token strings rather than id tensors.
+    """
+    tokens = [t5_tokenizer.convert_ids_to_tokens(ids) for ids in batch_ids]
+    results = t5_translator.translate_batch(
+        tokens,
+        beam_size=4,
+        max_decoding_length=64,
+    )
+    texts = [
+        t5_tokenizer.decode(
+            t5_tokenizer.convert_tokens_to_ids(r.hypotheses[0]),
+            skip_special_tokens=True,
+        )
+        for r in results
+    ]
+    return [t.strip() for t in texts]
+
+
+async def decode_ipa_to_text(ipa: str) -> str:
+    # Tokenize once, here: the batch only pads these ids. This also keeps
+    # the Rust tokenizer's encoder on the event loop thread, so the model
+    # thread never races it over truncation/padding settings.
+    input_ids = t5_tokenizer(
+        ipa,
+        truncation=True,
+        return_attention_mask=False,
+    )["input_ids"]
+    return await t5_batcher.submit(input_ids, len(input_ids))
+
+
+# -------------------------------------------------------------------
+# 6.1 Micro-batching: gather concurrent requests into one model call
+# -------------------------------------------------------------------
+MAX_BATCH = 8
+MAX_DELAY_MS = 40
+
+# Requests are grouped by length so a 3 s clip is never padded out to
+# the length of a 40 s clip in the same batch (<5 s, 5-15 s, 15-30 s, >30 s).
+W2V_BUCKET_SAMPLES = [5 * 16000, 15 * 16000, 30 * 16000]
+
+# Batch sizes a compiled wav2vec2 batch is padded up to (powers of two,
+# capped at MAX_BATCH), so every batch maps onto a warmed-up shape.
+W2V_COMPILED_BATCH_SIZES = sorted(
+    {min(2 ** i, MAX_BATCH) for i in range(MAX_BATCH.bit_length() + 1)}
+)
+T5_BUCKET_TOKENS = [16, 32, 64]
+
+
+class BucketedBatcher:
+    """
+    Micro-batcher with one pending queue per length bucket. Each bucket
+    is flushed on its own, once it is full or its oldest request has
+    waited MAX_DELAY_MS.
+    """
+
+    def __init__(self, run_batch, boundaries, finish_batch=None):
+        self.run_batch = run_batch
+        self.boundaries = boundaries
+        self.buckets = [deque() for _ in range(len(boundaries) + 1)]
+        self.wakeup = asyncio.Event()
+        # one dedicated thread per model: CUDA graphs recorded by the
+        # compiled model are tied to the thread that recorded them
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # Optional second stage: run_batch only launches the work and
+        # finish_batch collects it on its own thread, so batch N is
+        # finished while batch N+1 is already running on the model.
+        self.finish_batch = finish_batch
+        self.finish_executor = ThreadPoolExecutor(max_workers=1)
+        self.finishing = set()
+
+    async def submit(self, item, length: int):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        bucket = self.buckets[bisect.bisect_left(self.boundaries, length)]
+        bucket.append((loop.time(), item, future))
+        self.wakeup.set()
+        return await future
+
+    def pick_bucket(self, now: float):
+        """
+        Pick the fullest bucket if any is full, else the bucket whose
+        oldest request is past its deadline, else None.
+        """
+        full = [b for b in self.buckets if len(b) >= MAX_BATCH]
+        if full:
+            return max(full, key=len)
+
+        deadline = MAX_DELAY_MS / 1000
+        overdue = [b for b in self.buckets if b and now - b[0][0] >= deadline]
+        if overdue:
+            return min(overdue, key=lambda b: b[0][0])
+
+        return None
+
+    async def run(self) -> None:
+        """
+        Run the model once per flushed bucket and hand each caller
+        its own result (or the batch's exception).
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            now = loop.time()
+            bucket = self.pick_bucket(now)
+
+            if bucket is None:
+                # sleep until the next deadline or a new request
+                oldest = [b[0][0] for b in self.buckets if b]
+                timeout = min(oldest) + MAX_DELAY_MS / 1000 - now if oldest else None
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # skip requests whose client went away while they were queued
+            batch = []
+            while bucket and len(batch) < MAX_BATCH:
+                entry = bucket.popleft()
+                if not entry[2].cancelled():
+                    batch.append(entry)
+            if not batch:
+                continue
+
+            inputs = [item for _, item, _ in batch]
+            futures = [future for _, _, future in batch]
+
+            try:
+                # run off the event loop so new requests keep queueing
+                results = await loop.run_in_executor(
+                    self.executor, self.run_batch, inputs
+                )
+            except Exception as exc:
+                self.reject(futures, exc)
+                continue
+
+            if self.finish_batch is not None:
+                task = asyncio.create_task(self.finish(results, futures))
+                self.finishing.add(task)
+                task.add_done_callback(self.finishing.discard)
+                continue
+
+            self.resolve(futures, results)
+
+    async def finish(self, launched, futures) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.finish_executor, self.finish_batch, launched
+            )
+        except Exception as exc:
+            self.reject(futures, exc)
+            return
+
+        self.resolve(futures, results)
+
+    @staticmethod
+    def resolve(futures, results) -> None:
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def reject(futures, exc: Exception) -> None:
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
+
+
+w2v_batcher = BucketedBatcher(
+    launch_w2v_batch, W2V_BUCKET_SAMPLES, finish_batch=finish_w2v_batch
+)
+t5_batcher = BucketedBatcher(run_t5_batch, T5_BUCKET_TOKENS)
+
+
+async def start_batch_workers(app: FastAPI) -> None:
+    if W2V_COMPILE:
+        print("Compiling wav2vec2 (one warm-up per batch size and bucket)...")
+        await asyncio.get_running_loop().run_in_executor(
+            w2v_batcher.executor, warm_up_w2v
+        )
+
+    app.state.batch_workers = [
+        asyncio.create_task(w2v_batcher.run()),
+        asyncio.create_task(t5_batcher.run()),
+    ]
+
+
+async def stop_batch_workers(app: FastAPI) -> None:
+    for task in app.state.batch_workers:
+        task.cancel()
+    await asyncio.gather(*app.state.batch_workers, return_exceptions=True)
 
 
 # -------------------------------------------------------------------
@@ -272,15 +891,13 @@ async def run_pipeline(
     file: UploadFile = File(...),
     rules: str = Form(...),  # JSON string from frontend
 ):
-    # Parse rules JSON
-    rules_dict = json.loads(rules)
-    rule_cfg = RuleConfig(**rules_dict)
-
-    # Read audio
-    audio_bytes = await file.read()
+    # Parse + validate rules JSON in one step (pydantic-core, no dict
+    # intermediate)
+    rule_cfg = RuleConfig.model_validate_json(rules)
 
-    # 1) Audio -> phonemes
-    raw_ipa = transcribe_to_ipa(audio_bytes)
+    # 1) Audio -> phonemes (cached per clip), read straight from the
+    # upload's spooled temp file
+    raw_ipa = await transcribe_upload(file.file)
 
     # 1.1) Normalize IPA inventory
     normalized_ipa = normalize_ipa(raw_ipa)
@@ -289,7 +906,7 @@ async def run_pipeline(
     corrected_ipa = apply_rules(normalized_ipa, rule_cfg)
 
     # 3) IPA -> text
-    final_text = decode_ipa_to_text(corrected_ipa)
+    final_text = await decode_ipa_to_text(corrected_ipa)
 
     return PipelineResponse(
         raw_ipa=normalized_ipa,
@@ -299,3 +916,16 @@ async def run_pipeline(
         wav2vec2_model_used=WAV2VEC2_ID,
         t5_model_used=IPA2TEXT_ID,
     )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # One process (and one copy of the models) per worker; set
+    # WEB_CONCURRENCY to scale out on CPU or a shared GPU (MPS/MIG).
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+    )